@@ -1,10 +1,28 @@
-import os
+import os, stat, json, hashlib, itertools
 from conan.internal import check_duplicated_generator
 from conans.util.files import save
 
-class Waf(object):
+#name of the generated waf tool
+_OUTPUT_NAME = "conan_deps.py"
+
+#number of generated files kept in the output cache
+_MAX_CACHE_ENTRIES = 256
+
+#global Conan conf flags, as (conf name, waf variable)
+#'tools.build:exelinkflags' and 'tools.build:sharedlinkflags' are merged into LINKFLAGS
+_CONF_KEYS = (
+    ('tools.build:cflags', 'CFLAGS'),
+    ('tools.build:cxxflags', 'CXXFLAGS'),
+    ('tools.build:defines', 'DEFINES'),
+)
+
+class Waf:
+    __slots__ = ('conanfile', '_env_vars', '_cwd')
+
     def __init__(self, conanfile):
         self.conanfile = conanfile
+        self._env_vars = {}
+        self._cwd = None
 
     def get_use_name(self, ref_name, parent_ref = None):
         """
@@ -32,10 +50,30 @@ class Waf(object):
     def generate(self):
         check_duplicated_generator(self, self.conanfile)
 
-        output = self.gen_deps()
+        filename = os.path.join(self.conanfile.generators_folder, _OUTPUT_NAME)
 
         #add settings, which will be interpreted and applied at configuration time
+        #(serialized once, they're also part of the cache key)
         settings = self.conanfile.settings.serialize()
+        conan_config = self._get_conan_config()
+
+        #reuse the output of a previous run when all of the inputs are identical
+        cache_folder = self._get_cache_folder()
+        cache_key = cache_folder and self._get_cache_key(settings, conan_config)
+
+        #the input hash goes on the first line, so an up-to-date file can be
+        #detected without reading the rest of it. Warnings about the inputs
+        #(e.g. missing WAF_TOOLS entries) are only reported when the file is
+        #actually generated
+        header = f"# wafgenerator input hash: {cache_key}\n" if cache_key else ""
+        if header and _load_first_line(filename) == header:
+            return
+
+        cached = cache_key and os.path.join(cache_folder, f"{cache_key}.py")
+        if cached and self._load_cache(cached, filename, header):
+            return
+
+        output = self.gen_deps()
 
         output.update({
             #these are host settings
@@ -43,17 +81,12 @@ class Waf(object):
             #paths that should be added to sys.path (only waf tools currently)
             "DEP_SYS_PATHS": self._get_waftools_paths(),
             #global Conan config/flags
-            "CONAN_CONFIG": self._get_conan_config()
+            "CONAN_CONFIG": conan_config
         })
 
-        filename = os.path.join(
-            self.conanfile.generators_folder,
-            "conan_deps.py"
-        )
-
         set_conan_to_waf_arch(settings, output)
         set_conan_to_waf_os(settings, output)
-        set_conan_to_waf_compiler(settings, output)
+        set_conan_to_waf_compiler(settings, output, self.conanfile.output)
 
         deps = []
         for k,v in output.items():
@@ -67,10 +100,85 @@ class Waf(object):
         for p in output['DEP_SYS_PATHS']:
             syspaths.append('"%s",' % p.replace('\\', '\\\\'))
 
-        save(filename, waftool_src_template % (
+        #formatted in a single pass, the header included, to avoid copying the
+        #whole file more than once
+        content = waftool_src_template % (
+            header,
             'sys.path = [\n    %s\n]+sys.path' % '\n    '.join(syspaths),
             '\n    '.join(deps),
-        ))
+        )
+        _save_if_changed(filename, content)
+
+        if cached:
+            self._store_cache(cached, content)
+
+    def _get_cache_key(self, settings, conan_config):
+        """
+            Hash of everything that ends up in the generated file. Returns None
+            when a dependency has no package revision (e.g. editables), since
+            its contents can change without the reference changing.
+
+            Options are included because package_info() can read options that
+            package_id() discards (e.g. defines of header-only packages)
+        """
+        deps = []
+        for req, dep in self.conanfile.dependencies.items():
+            if dep.pref.revision is None:
+                return None
+            deps.append((req.build, req.run, dep.pref.repr_notime(), dep.package_folder,
+                         dep.options.serialize()))
+
+        key = json.dumps({
+            "settings": settings,
+            "conf": conan_config,
+            "deps": deps,
+            "gen_version": _get_generator_version(),
+        }, sort_keys=True, default=str)
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def _get_cache_folder(self):
+        """
+            Folder for cached outputs, or None if caching (including the input
+            hash check) was disabled with `user.wafgenerator:cache=False`. Can
+            be moved with `user.wafgenerator:cache_folder`, and defaults to
+            `$XDG_CACHE_HOME/wafgenerator` (`~/.cache/wafgenerator`)
+        """
+        conf = self.conanfile.conf
+        if not conf.get('user.wafgenerator:cache', True, check_type=bool):
+            return None
+        folder = conf.get('user.wafgenerator:cache_folder', check_type=str)
+        if folder:
+            return folder
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(base, 'wafgenerator')
+
+    def _load_cache(self, cached, filename, header):
+        #a missing or unreadable entry just means regenerating the file
+        try:
+            content = _load(cached)
+        except FileNotFoundError:
+            return False
+        except (OSError, UnicodeDecodeError) as e:
+            self.conanfile.output.warning(f"Could not read waf generator cache: {e}")
+            return False
+        if not content.startswith(header):
+            return False
+
+        _save_if_changed(filename, content)
+        try:
+            #entries are evicted by mtime, so keep the ones in use
+            os.utime(cached)
+        except OSError:
+            pass
+        return True
+
+    def _store_cache(self, cached, content):
+        try:
+            _save_atomic(cached, content)
+        except OSError as e:
+            self.conanfile.output.warning(f"Could not write waf generator cache: {e}")
+            return
+        _evict_cache(os.path.dirname(cached))
 
     def gen_usedeps(self):
         """
@@ -86,6 +194,7 @@ class Waf(object):
                 comp_deps = list(reversed(dep.cpp_info.get_sorted_components()))
 
     def gen_deps(self):
+        self._cwd = os.getcwd()
         out = {
             "ALL_CONAN_PACKAGES": [],
             "ALL_CONAN_PACKAGES_BUILD": [],
@@ -97,117 +206,153 @@ class Waf(object):
             'CONAN_RUN_FRAMEWORK_PATH': set(),
         }
 
-        depmap_host = {}
-        depmap_build = {}
+        depmap = {}
+        get_use_name = self.get_use_name
 
         for req, dep in self.conanfile.dependencies.items():
             # print(dep.ref, f", direct={req.direct}, build={req.build}")
-            depmap = depmap_build if req.build else depmap_host
+
+            #add 'build_' prefix to all usenames for build items
+            #avoids name conflicts while making build graph available in scripts
+            prefix = 'build_' if req.build else ''
 
             if dep.cpp_info.has_components:
                 comp_depnames = []
                 #generate "pkg::comp" for each comp
                 comps = dep.cpp_info.get_sorted_components().items()
                 for ref_name, cpp_info in comps:
-                    use_name = self.get_use_name(ref_name, dep.ref.name)
+                    use_name = prefix + get_use_name(ref_name, dep.ref.name)
                     comp_depnames.append(use_name)
                     depmap[use_name] = {
                         'run': req.run,
                         'build': req.build,
                         'cpp_info': cpp_info,
                         'usename': use_name,
-                        'requires': [self.get_use_name(c, dep.ref.name) for c in cpp_info.requires],
-                        'package': self.get_use_name(dep.ref.name),
+                        'requires': [prefix + get_use_name(c, dep.ref.name) for c in cpp_info.requires],
+                        'package': get_use_name(dep.ref.name),
                         'buildenv_info': dep.buildenv_info,
                         'runenv_info': dep.runenv_info,
                     }
 
                 #generate a parent "pkg::pkg"
-                use_name = self.get_use_name(dep.ref.name)
+                use_name = prefix + get_use_name(dep.ref.name)
                 depmap[use_name] = {
                     'run': req.run,
                     'build': req.build,
                     'cpp_info': dep.cpp_info,
                     'usename': use_name,
                     'requires': comp_depnames,
-                    'package': self.get_use_name(dep.ref.name),
+                    'package': get_use_name(dep.ref.name),
                     'buildenv_info': dep.buildenv_info,
                     'runenv_info': dep.runenv_info,
                 }
             else:
                 #only generate "pkg"
-                use_name = self.get_use_name(dep.ref.name)
+                use_name = prefix + get_use_name(dep.ref.name)
                 depmap[use_name] = {
                     'run': req.run,
                     'build': req.build,
                     'cpp_info': dep.cpp_info,
                     'usename': use_name,
-                    'requires': [self.get_use_name(c, dep.ref.name) for c in dep.cpp_info.requires],
-                    'package': use_name,
+                    'requires': [prefix + get_use_name(c, dep.ref.name) for c in dep.cpp_info.requires],
+                    'package': get_use_name(dep.ref.name),
                     'buildenv_info': dep.buildenv_info,
                     'runenv_info': dep.runenv_info,
                 }
 
-        def toposort_deps(self, depmap, root, i):
+        def toposort_deps(depmap):
+            #iterative post-order DFS, so deep graphs can't hit the recursion limit
             out = []
-            def visit(n):
-                if n.get('__visited', 0) == i:
-                    return
-                assert n.get('__at', 0) != i, "Cyclic dependencies!\n\tusename: %s\n\trequires: %s" % (n['usename'], n['requires'])
-                n['__at'] = i
-                for req in n['requires']:
-                    if req not in depmap:
-                        continue
-                    # assert req in depmap, "The following dependency for '%s' wasn't found: '%s'\n\tis the package broken, or am I broken?" % (n['usename'], req)
-                    visit(depmap[req])
-                n['__at'] = 0
-                n['__visited'] = i
-                out.append(n)
-            visit(root)
+            visited = set()
+            on_stack = set()
+            for root in depmap.values():
+                if root['usename'] in visited:
+                    continue
+                on_stack.add(root['usename'])
+                stack = [(root, iter(root['requires']))]
+                while stack:
+                    n, children = stack[-1]
+                    for req in children:
+                        if req not in depmap or req in visited:
+                            # assert req in depmap, "The following dependency for '%s' wasn't found: '%s'\n\tis the package broken, or am I broken?" % (n['usename'], req)
+                            continue
+                        child = depmap[req]
+                        assert req not in on_stack, "Cyclic dependencies!\n\tusename: %s\n\trequires: %s" % (child['usename'], child['requires'])
+                        on_stack.add(req)
+                        stack.append((child, iter(child['requires'])))
+                        break
+                    else:
+                        stack.pop()
+                        on_stack.discard(n['usename'])
+                        visited.add(n['usename'])
+                        out.append(n)
             return out
 
-        sortit = 0
-        
+        def set_use(depmap):
+            #'use' is the transitive closure of a node in topological order. Sort
+            #the whole graph once, then build closures bottom-up (requires are
+            #always visited first in post-order)
+            sorted_deps = toposort_deps(depmap)
+            rank = {}
+            closure = {}
+            for i, n in enumerate(sorted_deps):
+                rank[n['usename']] = -i
+                closure[n['usename']] = frozenset([n['usename']]).union(
+                    *(closure[req] for req in n['requires'] if req in depmap))
+            for n in sorted_deps:
+                n['use'] = [depmap[u] for u in sorted(closure[n['usename']], key=rank.__getitem__)]
+
         runenv = {}
-        buildenv = {}
+        host_buildenv = {}
+        build_buildenv = {}
 
-        #generate host dep info (includes, flags, etc)
-        for name, info in depmap_host.items():
-            sortit += 1
-            sorted_deps = toposort_deps(self, depmap_host, info, sortit)
-            info['use'] = list(reversed(sorted_deps))
+        set_use(depmap)
+        for name, info in depmap.items():
+            #generate dep info (includes, flags, etc)
             self.proc_cpp_info(info, out)
-            
-            #add env info
-            buildenv.update(info['buildenv_info'].vars(self.conanfile, scope="run"))
-            runenv.update(info['runenv_info'].vars(self.conanfile, scope="run"))
-
-        #collect bindirs
-        for name, info in depmap_build.items():
-            sortit += 1
-            sorted_deps = toposort_deps(self, depmap_build, info, sortit)
-            info['use'] = list(reversed(sorted_deps))
-            self.proc_cpp_info(info, out)
-
-            #add buildenv info
-            buildenv.update(info['buildenv_info'].vars(self.conanfile, scope="build"))
-            buildenv.update(info['runenv_info'].vars(self.conanfile, scope="build"))
 
-        buildenv['PATH'] = os.pathsep.join(list(out.get('CONAN_BUILD_BIN_PATH', set())) + ['$PATH'])
-        buildenv['LD_LIBRARY_PATH'] = os.pathsep.join(list(out.get('CONAN_BUILD_LIB_PATH', set())) + ['$LD_LIBRARY_PATH'])
-        buildenv['DYLD_LIBRARY_PATH'] = os.pathsep.join(list(out.get('CONAN_BUILD_LIB_PATH', set())) + ['$DYLD_LIBRARY_PATH'])
-        buildenv['DYLD_FRAMEWORK_PATH'] = os.pathsep.join(list(out.get('CONAN_BUILD_FRAMEWORK_PATH', set())) + ['$DYLD_FRAMEWORK_PATH'])
+            if info['build']:
+                #add buildenv info
+                build_buildenv.update(self._get_env_vars(info['buildenv_info'], "build"))
+                build_buildenv.update(self._get_env_vars(info['runenv_info'], "build"))
+            else:
+                #add env info
+                host_buildenv.update(self._get_env_vars(info['buildenv_info'], "run"))
+                runenv.update(self._get_env_vars(info['runenv_info'], "run"))
+
+        #build requirements take precedence
+        buildenv = {**host_buildenv, **build_buildenv}
+
+        #sets have no stable iteration order, sort them so that identical graphs
+        #always generate identical files
+        for k in ('CONAN_BUILD_BIN_PATH', 'CONAN_BUILD_LIB_PATH', 'CONAN_BUILD_FRAMEWORK_PATH',
+                  'CONAN_RUN_BIN_PATH', 'CONAN_RUN_LIB_PATH', 'CONAN_RUN_FRAMEWORK_PATH'):
+            out[k] = sorted(out[k])
+
+        buildenv['PATH'] = os.pathsep.join(out['CONAN_BUILD_BIN_PATH'] + ['$PATH'])
+        buildenv['LD_LIBRARY_PATH'] = os.pathsep.join(out['CONAN_BUILD_LIB_PATH'] + ['$LD_LIBRARY_PATH'])
+        buildenv['DYLD_LIBRARY_PATH'] = os.pathsep.join(out['CONAN_BUILD_LIB_PATH'] + ['$DYLD_LIBRARY_PATH'])
+        buildenv['DYLD_FRAMEWORK_PATH'] = os.pathsep.join(out['CONAN_BUILD_FRAMEWORK_PATH'] + ['$DYLD_FRAMEWORK_PATH'])
         
-        runenv['PATH'] = os.pathsep.join(list(out.get('CONAN_RUN_BIN_PATH', set())) + ['$PATH'])
-        runenv['LD_LIBRARY_PATH'] = os.pathsep.join(list(out.get('CONAN_RUN_LIB_PATH', set())) + ['$LD_LIBRARY_PATH'])
-        runenv['DYLD_LIBRARY_PATH'] = os.pathsep.join(list(out.get('CONAN_RUN_LIB_PATH', set())) + ['$DYLD_LIBRARY_PATH'])
-        runenv['DYLD_FRAMEWORK_PATH'] = os.pathsep.join(list(out.get('CONAN_RUN_FRAMEWORK_PATH', set())) + ['$DYLD_FRAMEWORK_PATH'])
+        runenv['PATH'] = os.pathsep.join(out['CONAN_RUN_BIN_PATH'] + ['$PATH'])
+        runenv['LD_LIBRARY_PATH'] = os.pathsep.join(out['CONAN_RUN_LIB_PATH'] + ['$LD_LIBRARY_PATH'])
+        runenv['DYLD_LIBRARY_PATH'] = os.pathsep.join(out['CONAN_RUN_LIB_PATH'] + ['$DYLD_LIBRARY_PATH'])
+        runenv['DYLD_FRAMEWORK_PATH'] = os.pathsep.join(out['CONAN_RUN_FRAMEWORK_PATH'] + ['$DYLD_FRAMEWORK_PATH'])
 
         out['CONAN_BUILDENV'] = buildenv
         out['CONAN_RUNENV'] = runenv
 
         return out
 
+    def _get_env_vars(self, env_info, scope):
+        #the same buildenv_info is queried by gen_deps and _get_waftools_paths
+        key = (id(env_info), scope)
+        envvars = self._env_vars.get(key)
+        if envvars is None:
+            envvars = env_info.vars(self.conanfile, scope=scope)
+            self._env_vars[key] = envvars
+        return envvars
+
     def proc_cpp_info(self, depinfo, out):
         name = depinfo['usename']
         pkg_name = depinfo['package']
@@ -217,11 +362,17 @@ class Waf(object):
             if v:
                 out[f"{k}_{name}"] = v
 
+        #like os.path.abspath, without calling getcwd for every path
+        cwd = self._cwd or os.getcwd()
+        isabs, exists, normpath = os.path.isabs, os.path.exists, os.path.normpath
+        def abspath(p):
+            return normpath(p) if isabs(p) else normpath(os.path.join(cwd, p))
+
         def resolvepath(v):
             if type(v) is list:
-                return [os.path.abspath(p) for p in v if os.path.exists(p)]
+                return [abspath(p) for p in v if exists(p)]
             else:
-                return [os.path.abspath(v)] if os.path.exists(v) else []
+                return [abspath(v)] if exists(v) else []
 
         def setpath(k, v):
             #convert relative paths from conan to absolute
@@ -234,20 +385,16 @@ class Waf(object):
                 setvar(k, ret[0])
                 return ret
 
-        if depinfo['build']:            
-            #add 'build_' prefix to all usenames for build items
-            #avoids name conflicts while making build graph available in scripts
-            name = f'build_{name}'
+        abs_bindirs = resolvepath(cpp_info.bindirs)
+        abs_libdirs = resolvepath(cpp_info.libdirs)
+        abs_fwdirs = resolvepath(cpp_info.frameworkdirs)
 
-            out["ALL_CONAN_PACKAGES_BUILD"].append(name)
-            #CONAN_USE is used by waftool to expand deps for usenames
-
-            setvar('CONAN_USE', ['build_%s' % d['usename'] for d in depinfo['use']])
+        #CONAN_USE is used by waftool to expand deps for usenames
+        setvar('CONAN_USE', [d['usename'] for d in depinfo['use']])
 
+        if depinfo['build']:
             #process build dependencies
-            abs_bindirs = setpath("BINPATH", cpp_info.bindirs)
-            abs_libdirs = setpath("LIBPATH", cpp_info.libdirs)
-            abs_fwdirs = setpath("FRAMEWORKPATH", cpp_info.frameworkdirs)
+            out["ALL_CONAN_PACKAGES_BUILD"].append(name)
 
             #accumulate deps info for generating PATH/LD_LIBRARY_PATH
             if depinfo['run']:
@@ -257,15 +404,12 @@ class Waf(object):
         else:
             #process host dependencies
             out["ALL_CONAN_PACKAGES"].append(name)
-            
-            #CONAN_USE is used by waftool to expand deps for usenames
-            setvar('CONAN_USE', [d['usename'] for d in depinfo['use']])
 
             #accumulate deps info for generating PATH/LD_LIBRARY_PATH
             if depinfo['run']:
-                out['CONAN_RUN_BIN_PATH'].update(resolvepath(cpp_info.bindirs))
-                out['CONAN_RUN_LIB_PATH'].update(resolvepath(cpp_info.libdirs))
-                out['CONAN_RUN_FRAMEWORK_PATH'].update(resolvepath(cpp_info.frameworkdirs))
+                out['CONAN_RUN_BIN_PATH'].update(abs_bindirs)
+                out['CONAN_RUN_LIB_PATH'].update(abs_libdirs)
+                out['CONAN_RUN_FRAMEWORK_PATH'].update(abs_fwdirs)
 
 
         libs = cpp_info.libs + cpp_info.system_libs + cpp_info.objects
@@ -275,22 +419,22 @@ class Waf(object):
         #`waflib.Tools.cxx.cxxshlib`. this could be handled by a waftool if it's
         #ever needed
 
-        linkflags = list(set(cpp_info.sharedlinkflags + cpp_info.exelinkflags))
+        linkflags = list(dict.fromkeys(itertools.chain(cpp_info.sharedlinkflags, cpp_info.exelinkflags)))
         setvar("LINKFLAGS", linkflags)
         setvar("LIB", libs)
-        setpath("LIBPATH", cpp_info.libdirs)
+        setvar("LIBPATH", abs_libdirs)
         setvar("CFLAGS", cpp_info.cflags)
         setvar("CXXFLAGS", cpp_info.cxxflags)
         setvar("INCLUDES", cpp_info.includedirs)
         setvar("DEFINES", cpp_info.defines)
         setvar("FRAMEWORK", cpp_info.frameworks)
-        setpath("FRAMEWORKPATH", cpp_info.frameworkdirs)
+        setvar("FRAMEWORKPATH", abs_fwdirs)
 
         #Extra non-waf variables from Conan cpp_info
         setpath("SRCPATH", cpp_info.srcdirs)
         setpath("RESPATH", cpp_info.resdirs)
         setpath("BUILDPATH", cpp_info.builddirs)
-        setpath("BINPATH", cpp_info.bindirs)
+        setvar("BINPATH", abs_bindirs)
 
         #Unused waf variables:
         # "ARCH"
@@ -301,44 +445,108 @@ class Waf(object):
         # "CPPFLAGS"
 
     def _get_conan_config(self):
-        conf_info = self.conanfile.conf
-        out = {
-            "CFLAGS": conf_info.get('tools.build:cflags', [], check_type=list),
-            
-            "CXXFLAGS": conf_info.get('tools.build:cxxflags', [], check_type=list),
-            
-            "DEFINES": conf_info.get('tools.build:defines', [], check_type=list),
-            
-            "LINKFLAGS":
-                conf_info.get('tools.build:exelinkflags', [], check_type=list) +
-                conf_info.get('tools.build:sharedlinkflags', [], check_type=list),
-        }
+        get = self.conanfile.conf.get
+        out = {}
+        for conf_name, key in _CONF_KEYS:
+            out[key] = get(conf_name, [], check_type=list)
+        out["LINKFLAGS"] = \
+            get('tools.build:exelinkflags', [], check_type=list) + \
+            get('tools.build:sharedlinkflags', [], check_type=list)
         return out
 
     def _get_waftools_paths(self):
         #enables distributing waf tools inside of conan packages
         #e.g. add a waf tool to the 'flatbuffers' package so that you can use
         #the flatc compiler from wscripts, and not worry about versioning
-        out = []
-        for require, dependency in self.conanfile.dependencies.items():
-            if not require.build:
-                continue #only find waf tools from build environment
-            envvars = dependency.buildenv_info.vars(self.conanfile, scope="build")
-            if "WAF_TOOLS" not in envvars.keys():
+        out = {} #ordered set of directories
+        checked = set()
+        #only find waf tools from build environment
+        for require, dependency in self.conanfile.dependencies.build.items():
+            #most tool requires declare no build environment at all
+            if not dependency.buildenv_info:
+                continue
+            envvars = self._get_env_vars(dependency.buildenv_info, "build")
+            waf_tools = envvars.get("WAF_TOOLS")
+            if waf_tools is None:
                 continue
 
-            tools = envvars["WAF_TOOLS"].strip().split(" ")
-            for entry in tools:
-                if not os.path.exists(entry):
+            for entry in waf_tools.split():
+                #entries listed by more than one package only need one stat
+                if entry in checked:
+                    continue
+                checked.add(entry)
+
+                try:
+                    st = os.stat(entry)
+                except OSError:
                     self.conanfile.output.warning(f"Waf tool entry not found: {entry}")
                     continue
-                
-                if os.path.isfile(entry):
-                    entry = os.sep.join(entry.split(os.sep)[:-1])
-                
-                if entry not in out:
-                    out.append(entry)
-        return out
+
+                if stat.S_ISREG(st.st_mode):
+                    entry = os.path.dirname(entry)
+
+                out[entry] = None
+        return list(out)
+
+def _load(filename):
+    #same encoding/newlines as `conans.util.files.save`
+    with open(filename, 'r', encoding='utf-8', newline='') as f:
+        return f.read()
+
+def _load_first_line(filename):
+    try:
+        with open(filename, 'r', encoding='utf-8', newline='') as f:
+            return f.readline()
+    except (FileNotFoundError, UnicodeDecodeError):
+        return None
+
+def _save_if_changed(filename, content):
+    #rewriting an identical file would only bump its mtime
+    try:
+        if _load(filename) == content:
+            return
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    _save_atomic(filename, content)
+
+def _save_atomic(filename, content):
+    #write to a temp file first so concurrent installs never see partial output
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    try:
+        save(tmp, content)
+        os.replace(tmp, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def _evict_cache(folder):
+    #keep the most recently used entries. Outputs of older generator versions
+    #are never hit again, so they age out here too
+    try:
+        entries = []
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.name.endswith('.py') and entry.is_file():
+                    entries.append((entry.stat().st_mtime, entry.path))
+    except OSError:
+        return
+    entries.sort(reverse=True)
+    for _, path in entries[_MAX_CACHE_ENTRIES:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+_generator_version = None
+def _get_generator_version():
+    #hash of this file, so that cached outputs are invalidated by any change to
+    #the generator itself
+    global _generator_version
+    if _generator_version is None:
+        with open(__file__, 'rb') as f:
+            _generator_version = hashlib.sha1(f.read()).hexdigest()
+    return _generator_version
 
 def set_conan_to_waf_os(settings, env):
     #try to map dest os to `waflib.Utils.unversioned_sys_platform()` outputs
@@ -368,7 +576,7 @@ def set_conan_to_waf_os(settings, env):
         env['IOS_SDK_NAME'] = settings.get('os.sdk')
         env['IOS_SDK_MINVER'] = settings.get('os.sdk_version')
 
-def set_conan_to_waf_compiler(settings, env):
+def set_conan_to_waf_compiler(settings, env, out):
     compiler = settings.get('compiler', None)
     if compiler == None:
         return
@@ -379,7 +587,7 @@ def set_conan_to_waf_compiler(settings, env):
     exception = settings.get('compiler.exception')
 
     if threads or exception:
-        warn(f'WARNING: MinGW flags not handled yet!!')
+        out.warning('MinGW flags not handled yet!!')
 
     env['CXXFLAGS'] = env.get('CXXFLAGS', [])
     env['LINKFLAGS'] = env.get('LINKFLAGS', [])
@@ -407,88 +615,88 @@ def set_conan_to_waf_compiler(settings, env):
         env['CXXFLAGS'].append(f'/{flag}')
 
 
+#based on Conan settings.yml + `walib.Tools.c_config.MACRO_TO_DEST_CPU`
+_ARCHMAP = {
+    'x86_64': [
+        'x86_64'
+    ],
+    'x86': [
+        'x86'
+    ],
+    'mips': [
+        'mips',
+        'mips64'
+    ],
+    'sparc': [
+        'sparc',
+        'sparcv9',
+    ],
+    'arm':  [
+        'armv4',
+        'armv4i',
+        'armv5el',
+        'armv5hf',
+        'armv6',
+        'armv7',
+        'armv7hf',
+        'armv7s',
+        'armv7k',
+        'armv8',
+        'armv8_32',
+        'armv8.3',
+    ],
+    'powerpc': [
+        'ppc32be',
+        'ppc32',
+        'ppc64le',
+        'ppc64',
+    ],
+    'sh': [
+        'sh4le',
+    ],
+    's390': [
+        's390',
+    ],
+    's390x': [
+        's390x',
+    ],
+    'xtensa': [
+        'xtensalx6',
+        'xtensalx106',
+        'xtensalx7',
+    ],
+    'e2k': [
+        'e2k-v2',
+        'e2k-v3',
+        'e2k-v4',
+        'e2k-v5',
+        'e2k-v6',
+        'e2k-v7',
+    ],
+
+    #in waf, but not in standard conan settings.yml:
+    # '__alpha__'   :'alpha',
+    # '__hppa__'    :'hppa',
+    # '__convex__'  :'convex',
+    # '__m68k__'    :'m68k',
+
+    #in conan, but not in waf
+    # avr
+    # asm.js
+    # wasm
+}
+
+#reverse lookup of _ARCHMAP: conan arch -> waf DEST_CPU
+_ARCH_TO_WAF = {arch: wafname for wafname, arches in _ARCHMAP.items() for arch in arches}
+
 def set_conan_to_waf_arch(settings, env):
-    #based on Conan settings.yml + `walib.Tools.c_config.MACRO_TO_DEST_CPU`
     #note the original conan arch can be found in the 'CONAN_SETTINGS' key
     arch = settings.get('arch', None)
     if arch == None:
         return
-    archmap = {
-        'x86_64': [
-            'x86_64'
-        ],
-        'x86': [
-            'x86'
-        ],
-        'mips': [
-            'mips',
-            'mips64'
-        ],
-        'sparc': [
-            'sparc',
-            'sparcv9',
-        ],
-        'arm':  [
-            'armv4',
-            'armv4i',
-            'armv5el',
-            'armv5hf',
-            'armv6',
-            'armv7',
-            'armv7hf',
-            'armv7s',
-            'armv7k',
-            'armv8',
-            'armv8_32',
-            'armv8.3',
-        ],
-        'powerpc': [
-            'ppc32be',
-            'ppc32',
-            'ppc64le',
-            'ppc64',
-        ],
-        'sh': [
-            'sh4le',
-        ],
-        's390': [
-            's390',
-        ],
-        's390x': [
-            's390x',
-        ],
-        'xtensa': [
-            'xtensalx6',
-            'xtensalx106',
-            'xtensalx7',
-        ],
-        'e2k': [
-            'e2k-v2',
-            'e2k-v3',
-            'e2k-v4',
-            'e2k-v5',
-            'e2k-v6',
-            'e2k-v7',
-        ],
-
-        #in waf, but not in standard conan settings.yml:
-        # '__alpha__'   :'alpha',
-        # '__hppa__'    :'hppa',
-        # '__convex__'  :'convex',
-        # '__m68k__'    :'m68k',
-
-        #in conan, but not in waf
-        # avr
-        # asm.js
-        # wasm
-    }
-    env['DEST_CPU'] = arch
-    for wafname in archmap:
-        if arch in archmap[wafname]:
-            env['DEST_CPU'] = wafname
-            break
-
-waftool_src_template = """# AUTOGENERATED -- DO NOT MODIFY
+    env['DEST_CPU'] = _ARCH_TO_WAF.get(arch, arch)
+
+waftool_src_template = """%s# AUTOGENERATED -- DO NOT MODIFY
 import os, sys, pathlib, waflib
 from waflib import Utils, Build
 from waflib.Logs import warn
@@ -531,8 +739,12 @@ def configure(conf):
     if not conf.env.CONAN_DONT_ACTIVATE:
         conf.activate_conan_env()
 
-    for p in conf.env.ALL_CONAN_PACKAGES:
-        conf.msg('Conan usename', p)
+    packages = conf.env.ALL_CONAN_PACKAGES
+    if conf.options.verbose:
+        for p in packages:
+            conf.msg('Conan usename', p)
+    elif packages:
+        conf.msg('Conan usenames (%%d)' %% len(packages), ' '.join(packages))
 
     _override_default_compiler_selection(conf, conf.env)
     _apply_cppstd(conf, conf.env)
@@ -569,12 +781,13 @@ def activate_conan_env(ctx, env='build'):
 @before_method("process_use")
 def expand_conan_targets(tg):
     uselist = Utils.to_list(getattr(tg, 'use', []))
+    seen = set(uselist)
     for usename in uselist:
-        if (f'CONAN_USE_{usename}' in tg.env):
-            deps = tg.env[f'CONAN_USE_{usename}']
-        else:
-            continue
-        [uselist.append(r) for r in deps if r not in uselist]
+        deps = tg.env[f'CONAN_USE_{usename}']
+        for r in deps:
+            if r not in seen:
+                seen.add(r)
+                uselist.append(r)
     tg.use = uselist
 
 
@@ -670,6 +883,18 @@ def install_conan_package(bld, dest_root, **kw):
     _install(framework_out, dest_framework)
 
 
+_COMPILER_NAME_MAP = {
+    #Conan name:    (C++ name, C name)
+    'clang':        ('clangxx', 'clang'),
+    'apple-clang':  ('clangxx', 'clang'),
+    'gcc':          ('gxx', 'gcc'),
+    'msvc':         ('msvc', 'msvc'),
+    'sun-cc':       ('suncxx', 'suncc'),
+    'intel-cc':     ('icpc', 'icc'),
+    'qcc':          (None, None),
+    'mcst-lcc':     (None, None),
+}
+
 def _override_default_compiler_selection(conf, env):
     # The following adds the compiler name to the front of that c_config search
     # list(s). This activates the auto-detection feature for the compiler name.
@@ -683,19 +908,8 @@ def _override_default_compiler_selection(conf, env):
 
     # NOTE: the following does nothing if using env for toolchain selection.
 
-    compile_name_map = {
-        #Conan name:    (C++ name, C name)
-        'clang':        ('clangxx', 'clang'),
-        'apple-clang':  ('clangxx', 'clang'),
-        'gcc':          ('gxx', 'gcc'),
-        'msvc':         ('msvc', 'msvc'),
-        'sun-cc':       ('suncxx', 'suncc'),
-        'intel-cc':     ('icpc', 'icc'),
-        'qcc':          (None, None),
-        'mcst-lcc':     (None, None),
-    }
     compiler_name = env.CONAN_SETTINGS['compiler']
-    (cxx, cc) = compile_name_map[compiler_name]
+    (cxx, cc) = _COMPILER_NAME_MAP[compiler_name]
 
     os = Utils.unversioned_sys_platform() # waf uses build os for compiler detection
     if cxx and os in cxx_compiler:
@@ -731,6 +945,43 @@ def _override_default_compiler_selection(conf, env):
         env['MSVC_TARGETS'] = [arch]
 
 
+_CPPSTD_FLAGS = {
+    'em++': {
+        '98':       ['-std=c++98'],
+        'gnu98':    ['-std=gnu++98'],
+        '11':       ['-std=c++11'],
+        'gnu11':    ['-std=gnu++11'],
+        '14':       ['-std=c++14'],
+        'gnu14':    ['-std=gnu++14'],
+        '17':       ['-std=c++17'],
+        'gnu17':    ['-std=gnu++17'],
+        '20':       ['-std=c++20'],
+        'gnu20':    ['-std=gnu++20'],
+        '23':       ['-std=c++23'],
+        'gnu23':    ['-std=gnu++23'],
+    },
+    'gcc': {
+        '98':       ['--std', 'c++98'],
+        'gnu98':    ['--std', 'gnu++98'],
+        '11':       ['--std', 'c++11'],
+        'gnu11':    ['--std', 'gnu++11'],
+        '14':       ['--std', 'c++14'],
+        'gnu14':    ['--std', 'gnu++14'],
+        '17':       ['--std', 'c++17'],
+        'gnu17':    ['--std', 'gnu++17'],
+        '20':       ['--std', 'c++20'],
+        'gnu20':    ['--std', 'gnu++20'],
+        '23':       ['--std', 'c++23'],
+        'gnu23':    ['--std', 'gnu++23'],
+    },
+    'msvc': {
+        '14':       ['/std:c++14'],
+        '17':       ['/std:c++17'],
+        '20':       ['/std:c++20'],
+        '23':       ['/std:latest']
+    },
+}
+
 def _apply_cppstd(conf, env):
     cppstd = env.CONAN_SETTINGS.get('compiler.cppstd', None)
     if cppstd == None:
@@ -741,47 +992,8 @@ def _apply_cppstd(conf, env):
     if env.CONAN_SETTINGS['os'] == 'Emscripten':
         compiler = 'em++'
 
-    flags = {
-        'em++': {
-            '98':       ['-std=c++98'],
-            'gnu98':    ['-std=gnu++98'],
-            '11':       ['-std=c++11'],
-            'gnu11':    ['-std=gnu++11'],
-            '14':       ['-std=c++14'],
-            'gnu14':    ['-std=gnu++14'],
-            '17':       ['-std=c++17'],
-            'gnu17':    ['-std=gnu++17'],
-            '20':       ['-std=c++20'],
-            'gnu20':    ['-std=gnu++20'],
-            '23':       ['-std=c++23'],
-            'gnu23':    ['-std=gnu++23'],
-        },
-        'gcc': {
-            '98':       ['--std', 'c++98'],
-            'gnu98':    ['--std', 'gnu++98'],
-            '11':       ['--std', 'c++11'],
-            'gnu11':    ['--std', 'gnu++11'],
-            '14':       ['--std', 'c++14'],
-            'gnu14':    ['--std', 'gnu++14'],
-            '17':       ['--std', 'c++17'],
-            'gnu17':    ['--std', 'gnu++17'],
-            '20':       ['--std', 'c++20'],
-            'gnu20':    ['--std', 'gnu++20'],
-            '23':       ['--std', 'c++23'],
-            'gnu23':    ['--std', 'gnu++23'],
-        },
-        'msvc': {
-            '14':       ['/std:c++14'],
-            '17':       ['/std:c++17'],
-            '20':       ['/std:c++20'],
-            '23':       ['/std:latest']
-        },
-    }
-    if compiler not in flags:
-        # gcc flags as fallback is probably fine...
-        env.append_value('CXXFLAGS', flags['gcc'][cppstd])
-    else:
-        env.append_value('CXXFLAGS', flags[compiler][cppstd])
+    # gcc flags as fallback is probably fine...
+    env.append_value('CXXFLAGS', _CPPSTD_FLAGS.get(compiler, _CPPSTD_FLAGS['gcc'])[cppstd])
 
 
 def _apply_build_type(conf, env):
@@ -0,0 +1,6 @@
+from conan import ConanFile
+
+class WafCacheTestEditable(ConanFile):
+    name = "wafcachetest"
+    version = "0.1"
+    package_type = "header-library"
@@ -0,0 +1,16 @@
+from conan import ConanFile
+
+class WafCacheTestOption(ConanFile):
+    name = "wafcacheopt"
+    version = "0.1"
+    package_type = "header-library"
+    options = {"extra_define": [True, False]}
+    default_options = {"extra_define": False}
+
+    def package_id(self):
+        #the option only affects package_info, like eigen's MPL2_only
+        self.info.clear()
+
+    def package_info(self):
+        if self.options.extra_define:
+            self.cpp_info.defines = ["WAFCACHEOPT_EXTRA"]
@@ -0,0 +1,104 @@
+import shutil
+import tempfile
+import os, sys
+
+import pytest
+
+from tools import run, load
+
+HEADER = '# wafgenerator input hash: '
+
+@pytest.fixture(autouse=True)
+def conan_test():
+    old_env = dict(os.environ)
+    env_vars = {"CONAN_HOME": tempfile.mkdtemp(suffix='conans'),
+                "XDG_CACHE_HOME": tempfile.mkdtemp(suffix='cache')} 
+    os.environ.update(env_vars)
+    current = tempfile.mkdtemp(suffix="conans")
+    cwd = os.getcwd()
+    os.chdir(current)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(old_env)
+
+def setup_conan():
+    repo = os.path.join(os.path.dirname(__file__), "../../..")
+    run(f"conan config install {repo}")
+    run("conan profile detect")
+    os.chdir(os.path.dirname(__file__))
+    shutil.rmtree('build', ignore_errors=True)
+
+def cache_folder():
+    return os.path.join(os.environ['XDG_CACHE_HOME'], 'wafgenerator')
+
+def cache_entries():
+    folder = cache_folder()
+    if not os.path.isdir(folder):
+        return []
+    return [f for f in os.listdir(folder) if f.endswith('.py')]
+
+def test_waf_cache():
+    setup_conan()
+    deps = os.path.join('build', 'conan_deps.py')
+
+    run("conan install . -of=build --build=missing -s build_type=Release")
+    content = load(deps)
+    assert content.startswith(HEADER)
+    assert len(cache_entries()) == 1
+
+    #identical inputs leave the file untouched
+    mtime = os.stat(deps).st_mtime_ns
+    run("conan install . -of=build --build=missing -s build_type=Release")
+    assert load(deps) == content
+    assert os.stat(deps).st_mtime_ns == mtime
+
+    #a deleted file is restored from the cache entry, not regenerated
+    entry = os.path.join(cache_folder(), cache_entries()[0])
+    header, rest = load(entry).split('\n', 1)
+    with open(entry, 'w', newline='') as f:
+        f.write(f"{header}\n# cached marker\n{rest}")
+    os.remove(deps)
+    run("conan install . -of=build --build=missing -s build_type=Release")
+    assert '# cached marker' in load(deps)
+    assert len(cache_entries()) == 1
+
+    #different settings produce a different hash
+    run("conan install . -of=build --build=missing -s build_type=Debug")
+    debug_content = load(deps)
+    assert debug_content.startswith(HEADER)
+    assert debug_content.splitlines()[0] != content.splitlines()[0]
+    assert len(cache_entries()) == 2
+
+    #disabling the cache also disables the input hash check
+    run("conan install . -of=build --build=missing -s build_type=Debug -c user.wafgenerator:cache=False")
+    assert not load(deps).startswith(HEADER)
+
+def test_waf_cache_editable():
+    setup_conan()
+    run("conan editable add editable")
+    try:
+        run("conan install --requires=wafcachetest/0.1 -g Waf -of=build")
+    finally:
+        run("conan editable remove editable")
+
+    #packages without a revision can change at any time, so nothing is cached
+    assert not load(os.path.join('build', 'conan_deps.py')).startswith(HEADER)
+    assert cache_entries() == []
+
+def test_waf_cache_options():
+    setup_conan()
+    run("conan create option")
+    deps = os.path.join('build', 'conan_deps.py')
+
+    #the option doesn't change the package id, only the generated defines
+    run("conan install --requires=wafcacheopt/0.1 -g Waf -of=build")
+    content = load(deps)
+    assert 'WAFCACHEOPT_EXTRA' not in content
+
+    run("conan install --requires=wafcacheopt/0.1 -g Waf -of=build -o wafcacheopt/*:extra_define=True")
+    assert 'WAFCACHEOPT_EXTRA' in load(deps)
+    assert load(deps).splitlines()[0] != content.splitlines()[0]
+    assert len(cache_entries()) == 2
@@ -9,7 +9,8 @@ from tools import run
 @pytest.fixture(autouse=True)
 def conan_test():
     old_env = dict(os.environ)
-    env_vars = {"CONAN_HOME": tempfile.mkdtemp(suffix='conans')} 
+    env_vars = {"CONAN_HOME": tempfile.mkdtemp(suffix='conans'),
+                "XDG_CACHE_HOME": tempfile.mkdtemp(suffix='cache')} 
     os.environ.update(env_vars)
     current = tempfile.mkdtemp(suffix="conans")
     cwd = os.getcwd()